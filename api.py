@@ -1,14 +1,96 @@
 from openai import OpenAI
+import diskcache
+import hashlib
+import json
 import os
+try:
+    import tiktoken
+except ImportError:#没有 tiktoken 时按 UTF-8 字节数估算 token
+    tiktoken=None
 open_ai_api=os.environ.get("OPENAI_API_KEY")
 open_ai_url=os.environ.get("OPENAI_API_BASE_URL")
 client=OpenAI(api_key=open_ai_api,base_url=open_ai_url)
-conversation_history=[]
-def generate_text(prompt):#简单的模型历史对话
-    conversation_history.append({"role":"user","content":prompt})
-    response=client.chat.completions.create(model="gpt-4",
-                                            messages=conversation_history,
-                                            temperature=0.5,
-                                            max_tokens=500)
-    
-    return response.choices[0].message.content
+
+# 默认用便宜的小模型；需要更强推理能力的调用显式传 model
+DEFAULT_MODEL="gpt-4o-mini"
+
+# 模型调用缓存：内存 + 磁盘，按请求参数的 sha256 作为键
+CACHE_EXPIRE=86400
+_disk_cache=diskcache.Cache(os.environ.get("LLM_CACHE_DIR",".llm_cache"))
+_mem_cache={}
+stats={"hits":0,"misses":0}
+
+def _cache_key(params):
+    return hashlib.sha256(json.dumps(params,sort_keys=True,ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _complete(**params):#带缓存的 chat.completions 调用，返回文本（传 tools 时返回函数调用的参数 JSON）
+    key=_cache_key(params)
+    if key in _mem_cache:
+        stats["hits"]+=1
+        return _mem_cache[key]
+    content=_disk_cache.get(key)
+    if content is not None:
+        stats["hits"]+=1
+        _mem_cache[key]=content
+        return content
+    stats["misses"]+=1
+    response=client.chat.completions.create(**params)
+    message=response.choices[0].message
+    content=message.tool_calls[0].function.arguments if params.get("tools") else message.content
+    _mem_cache[key]=content
+    _disk_cache.set(key,content,expire=CACHE_EXPIRE)
+    return content
+
+def _build_messages(prompt,system=None,history=None):
+    messages=[]
+    if system:
+        messages.append({"role":"system","content":system})
+    if history:
+        messages.extend(history)
+    messages.append({"role":"user","content":prompt})
+    return messages
+
+def generate_text(prompt,system=None,history=None,model=DEFAULT_MODEL,temperature=0):#无状态调用；system 为固定指令，放在最前以命中前缀缓存；history 为可选的既往对话
+    return _complete(model=model,
+                     messages=_build_messages(prompt,system,history),
+                     temperature=temperature,
+                     max_tokens=500)
+
+def generate_json(prompt,schema,name,system=None,history=None,model=DEFAULT_MODEL,temperature=0):#用 function calling 强制模型按 schema 返回，解析为 dict
+    arguments=_complete(model=model,
+                        messages=_build_messages(prompt,system,history),
+                        temperature=temperature,
+                        max_tokens=500,
+                        tools=[{"type":"function","function":{"name":name,"parameters":schema}}],
+                        tool_choice={"type":"function","function":{"name":name}})
+    return json.loads(arguments)
+
+def _estimate_tokens(text):#字节级 BPE 每个 token 至少 1 字节，UTF-8 字节数是 token 数的上界（中文每字 3 字节）
+    return len(text.encode("utf-8"))
+
+def count_tokens(text,model=DEFAULT_MODEL):
+    if tiktoken is None:
+        return _estimate_tokens(text)
+    try:
+        encoding=tiktoken.encoding_for_model(model)
+    except KeyError:#旧版 tiktoken 不认识的模型名
+        return _estimate_tokens(text)
+    return len(encoding.encode(text))
+
+class ConversationSession:#确实需要多轮上下文时使用；历史超过 max_history_tokens 时丢弃最早的轮次
+    def __init__(self,system=None,max_history_tokens=4000,model=DEFAULT_MODEL):
+        self.system=system
+        self.model=model
+        self.max_history_tokens=max_history_tokens
+        self.history=[]
+
+    def ask(self,prompt):
+        reply=generate_text(prompt,system=self.system,history=self.history,model=self.model)
+        self.history.append({"role":"user","content":prompt})
+        self.history.append({"role":"assistant","content":reply})
+        self._truncate()
+        return reply
+
+    def _truncate(self):#始终保留最新一轮，即使它本身就超过上限
+        while len(self.history)>2 and sum(count_tokens(m["content"] or "",self.model) for m in self.history)>self.max_history_tokens:
+            del self.history[:2]#按 user/assistant 成对丢弃
@@ -1,54 +1,127 @@
 from metapub import PubMedFetcher,FindIt
-from api import generate_text
+from api import generate_text,generate_json
 from utils.download import save_pdfs_from_url_list
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import datetime
+import diskcache
+import math
+import os
 fetch=PubMedFetcher()
+# PubMed 查询的磁盘缓存，重复运行时不再访问网络
+PUBMED_CACHE_EXPIRE=7*86400
+_pm_cache=diskcache.Cache(os.environ.get("PUBMED_CACHE_DIR",".pubmed_cache"))
+# NCBI 限速：无 API key 时 3 次/秒，有 key 时 10 次/秒
+NCBI_WORKERS=10 if os.environ.get("NCBI_API_KEY") else 3
+
+def ncbi_map(func,items):#并发调用 NCBI 接口，结果保持输入顺序
+    with ThreadPoolExecutor(max_workers=NCBI_WORKERS) as ex:
+        return list(ex.map(func,items))
+
+@_pm_cache.memoize(expire=PUBMED_CACHE_EXPIRE)
+def cached_pmids_for_query(query,retmax):
+    return fetch.pmids_for_query(query,retmax=retmax)
+
+@_pm_cache.memoize(expire=PUBMED_CACHE_EXPIRE)
+def _article_fields(pmid):#只缓存后续用到的字段，避免把整篇 XML 写进缓存
+    article=fetch.article_by_pmid(pmid)
+    return {"pmid":article.pmid,"title":article.title,"pubdate":article.pubdate,
+            "year":article.year,"abstract":article.abstract}
+
+def cached_article(pmid):#返回带上述字段的轻量对象
+    return SimpleNamespace(**_article_fields(pmid))
+
+# related_pmids 返回按关联类型分组的 dict，被引次数取 "citedin" 列表的长度；
+# name 带上版本后缀，避免复用旧版本按 dict 长度写入的缓存
+@_pm_cache.memoize(name="citation_count.citedin", expire=PUBMED_CACHE_EXPIRE)
+def citation_count(pmid):#被引次数
+    return len((fetch.related_pmids(pmid) or {}).get("citedin", []))
+
 def format_reviews(reviews_metadata):#将多篇文章格式化为字符串
     formatted_reviews = []
     for review in reviews_metadata:
         formatted_reviews.append(format_review(review))
     return "\n\n".join(formatted_reviews)
 
-def format_review(article):#将标题、日期、引用量、摘要、文章id喂给模型
+def article_citations(article):#被引次数，优先读取 ReviewSearch 预先算好的值
+    citations = getattr(article, "_citation_count", None)
+    if citations is None:
+        citations = citation_count(article.pmid)
+    return citations
+
+# 粗排权重：年份越新、被引次数（citedin）越高得分越高
+RECENCY_WEIGHT=1.0
+CITATION_WEIGHT=1.0
+ABSTRACT_CHARS=300#喂给模型的摘要只保留前若干字符
+
+def prerank_reviews(reviews_metadata,keep):#按发表年份和被引次数粗排，只保留前 keep 篇；同分时保持输入顺序
+    this_year = datetime.date.today().year
+    def score(article):
+        try:
+            age = this_year - int(article.year)
+        except (TypeError, ValueError):
+            age = 5#缺失年份按检索窗口（近5年）的上限处理
+        return CITATION_WEIGHT*math.log1p(article_citations(article)) - RECENCY_WEIGHT*age
+    return sorted(reviews_metadata,key=score,reverse=True)[:keep]
+
+def format_review(article):#将标题、日期、被引次数、摘要（截断）、文章id喂给模型
     return f"""
     标题: {article.title}
     发表日期: {article.pubdate}
-    引用量: {fetch.related_pmids(article.pmid).__len__()}
-    摘要: {article.abstract}
+    被引次数: {article_citations(article)}
+    摘要: {(article.abstract or "")[:ABSTRACT_CHARS]}
     文章id: {article.pmid}
     """
 
+# 固定指令放在 system 消息中，动态内容（问题、综述列表）放在最后，便于命中前缀缓存
+SEARCH_SYSTEM_PROMPT = """
+作为⽣物医学检索专家,为用户给出的研究问题⽣成PubMed检索策略。
+要求:
+1. 使⽤MeSH术语
+2. 结合⾃由词检索
+3. 使⽤布尔运算符(AND/OR/NOT)
+4. 限定⽂献类型为综述(Review)
+5. 限定近5年⽂献
+注意事项：
+请仅仅返回检索策略即可，不要任何的说明。
+"""
+
+SELECTION_SYSTEM_PROMPT = """
+从用户给出的综述中选择最相关的若干篇。
+选择标准:
+1. 覆盖查询主题的不同⽅⾯
+2. ⾼引⽤量和影响因⼦
+3. 最新发表⽇期
+4. 包含机制研究和临床应⽤
+请通过 select_reviews 返回所选择综述的文章id。
+"""
+
+SELECTION_SCHEMA = {
+    "type": "object",
+    "properties": {"pmids": {"type": "array", "items": {"type": "string"}}},
+    "required": ["pmids"],
+}
+
 def ReviewSearch(user_query,maxlen=20):#生成搜索策略并检索文章
-    prompt = f"""
-    作为⽣物医学检索专家,为以下研究问题⽣成PubMed检索策略:
-    问题: {user_query}
-    要求:
-    1. 使⽤MeSH术语
-    2. 结合⾃由词检索
-    3. 使⽤布尔运算符(AND/OR/NOT)
-    4. 限定⽂献类型为综述(Review)
-    5. 限定近5年⽂献
-    注意事项：
-    请仅仅返回检索策略即可，不要任何的说明。
-    """
-    result=generate_text(prompt)
-    pmids=fetch.pmids_for_query(str(result),retmax=maxlen)
-    reviews_metadata = [fetch.article_by_pmid(pmid) for pmid in pmids]
+    prompt = f"问题: {user_query}"
+    result=generate_text(prompt,system=SEARCH_SYSTEM_PROMPT,model="gpt-4")#检索式质量决定召回，保留大模型
+    pmids=cached_pmids_for_query(str(result),maxlen)
+    reviews_metadata = ncbi_map(cached_article,pmids)
+    # 一次性并发计算引用量并挂到文章对象上，format_review 直接读取
+    citations = ncbi_map(citation_count,pmids)
+    for article,count in zip(reviews_metadata,citations):
+        article._citation_count = count
     return reviews_metadata
 
 def ReviewSelection(reviews_metadata,topk=5)->list:#选择最合适的文章
+    reviews_metadata = prerank_reviews(reviews_metadata,keep=2*topk)
     selection_prompt = f"""
-    从以下{len(reviews_metadata)}篇综述中选择最相关的{topk}篇:
+    以下共{len(reviews_metadata)}篇综述:
     {format_reviews(reviews_metadata)}
-    选择标准:
-    1. 覆盖查询主题的不同⽅⾯
-    2. ⾼引⽤量和影响因⼦
-    3. 最新发表⽇期
-    4. 包含机制研究和临床应⽤
-    请用,隔开的形式返回所选择的{topk}篇综述的pid，不需要其他额外叙述。
+    请从中选择最相关的{topk}篇。
     """
-    selected_str = str(generate_text(selection_prompt)) 
-    selected_str = selected_str.replace("[", "").replace("]", "")
-    selected_5=[pid.strip() for pid in selected_str.split(",") if pid.strip()]
+    selected = generate_json(selection_prompt,SELECTION_SCHEMA,"select_reviews",system=SELECTION_SYSTEM_PROMPT)#从列表中挑选，用默认小模型
+    selected_5=[str(pid).strip() for pid in selected.get("pmids",[]) if str(pid).strip()][:topk]
     return selected_5
 
 # 示例运行
@@ -29,14 +29,31 @@ Returns:
 from typing import List, Optional, Iterable, Dict, Any
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+import threading
 import hashlib
 import re
 
+# --------- Shared HTTP session ----------
+# 模块级 Session：keep-alive 复用同一站点的 TCP/TLS 连接，并对限流/服务端错误自动重试
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                       max_retries=Retry(total=3, backoff_factor=0.5,
+                                         status_forcelist=[429, 500, 502, 503, 504]))
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
 # --------- Helpers for safe filename ----------
+# 预编译：\w 与 str.isalnum() 加下划线等价，因此与逐字符判断结果一致
+_UNSAFE_CHARS_RE = re.compile(r"[^\w .\-()\[\]]+")
+
 def _clean_name(s: str, maxlen: int = 200) -> str:
     # 保留字母数字和这些字符，去掉其它危险字符
-    safe = "".join(c for c in s if c.isalnum() or c in " .-_()[]")
+    safe = _UNSAFE_CHARS_RE.sub("", s)
     safe = safe.strip()
     if len(safe) > maxlen:
         safe = safe[:maxlen]
@@ -69,8 +86,6 @@ def make_safe_filename_from_url(url: Optional[str], fallback_prefix: str = "file
     for cand in candidates:
         if cand:
             name = unquote(str(cand))
-            # remove weird chars
-            name = re.sub(r"[^\w\-\.\(\)\[\] ]+", "", name)
             c = _clean_name(name, maxlen=maxlen-4)
             if c:
                 if not c.lower().endswith(".pdf"):
@@ -95,68 +110,112 @@ def make_safe_filename_from_url(url: Optional[str], fallback_prefix: str = "file
     return _clean_name(name, maxlen=maxlen)
 
 # --------- Minimal PDF download ----------
-def download_pdf(url: str, save_path: str, timeout: int = 20) -> bool:
+WRITE_CHUNK = 1 << 20  # 1 MiB
+
+def _write_stream(r: requests.Response, save_path: str) -> None:
+    """
+    将响应流写入 save_path：先写临时文件，落盘后用 os.replace 原子替换，不会留下残缺文件。
+    已知 Content-Length 时预分配空间，按 1 MiB 块写入。
+    """
+    tmp_path = save_path + ".part"
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(tmp_path, flags, 0o644)
+    ok = False
+    try:
+        try:
+            total = int(r.headers.get("Content-Length", 0))
+        except ValueError:
+            total = 0
+        if total > 0 and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, total)
+            except OSError:
+                pass  # 文件系统不支持预分配时忽略
+        written = 0
+        for chunk in r.iter_content(WRITE_CHUNK):
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fd, view):]
+            written += len(chunk)
+        # 压缩传输等情况下实际长度可能与 Content-Length 不同，截掉多余的预分配部分
+        os.ftruncate(fd, written)
+        getattr(os, "fdatasync", os.fsync)(fd)
+        ok = True
+    finally:
+        os.close(fd)
+        if ok:
+            os.replace(tmp_path, save_path)
+        else:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def download_pdf(url: str, save_path: str, timeout: int = 20,
+                 session: requests.Session = _SESSION) -> bool:
     """
     下载 URL 如果它指向 PDF 则保存到 save_path（包含 .pdf 扩展名）。
+    session 默认使用模块级共享 Session。
     返回 True 成功，False 失败或不是 PDF。
     """
     if not url or not str(url).strip():
         return False
     try:
-        # 先尝试 HEAD（部分站点不支持）
-        try:
-            head = requests.head(url, allow_redirects=True, timeout=8)
-            ctype = head.headers.get("Content-Type", "").lower()
-        except Exception:
-            ctype = ""
-
-        # 如果 URL 以 .pdf 结尾或 HEAD 表示 PDF，直接 GET 保存
-        if url.lower().endswith(".pdf") or "application/pdf" in ctype:
-            r = requests.get(url, stream=True, timeout=timeout, allow_redirects=True)
-            if r.status_code == 200 and ("application/pdf" in r.headers.get("Content-Type", "").lower() or url.lower().endswith(".pdf")):
-                with open(save_path, "wb") as f:
-                    for chunk in r.iter_content(8192):
-                        if chunk:
-                            f.write(chunk)
-                return True
-            else:
+        # 直接 GET（不再先发 HEAD），根据响应头和重定向后的最终 URL 判断是否为 PDF
+        with session.get(url, stream=True, timeout=timeout, allow_redirects=True) as r:
+            ctype = r.headers.get("Content-Type", "").lower()
+            is_pdf = ("application/pdf" in ctype
+                      or url.lower().endswith(".pdf")
+                      or r.url.lower().endswith(".pdf"))
+            if r.status_code != 200 or not is_pdf:
+                # 不是 PDF（按你的要求不解析 HTML 获取 PDF 链接）；不读取 body 直接关闭
                 return False
-
-        # 否则做 GET 再判断 content-type（有时候 GET 会返回 PDF）
-        r = requests.get(url, stream=True, timeout=timeout, allow_redirects=True)
-        if r.status_code == 200 and "application/pdf" in r.headers.get("Content-Type", "").lower():
-            with open(save_path, "wb") as f:
-                for chunk in r.iter_content(8192):
-                    if chunk:
-                        f.write(chunk)
+            _write_stream(r, save_path)
             return True
 
-        # 不是 PDF（按你的要求不解析 HTML 获取 PDF 链接）
-        return False
-
     except Exception:
         # 任意异常视为失败
         return False
 
 # --------- Public API ----------
+def _host_key(url: str) -> str:
+    """返回用于按域名限流的 key；URL 无法解析时返回 ""（交给 download_pdf 判为失败）。"""
+    try:
+        return urlparse(url).netloc.lower()
+    except ValueError:
+        return ""
+
+def _download_one(url: str, save_path: str, timeout: int,
+                  session: requests.Session, gate: threading.Semaphore) -> bool:
+    """在线程池中下载单个 URL；同一域名的并发数受 gate 限制，避免压垮单个站点。"""
+    with gate:
+        return download_pdf(url, save_path, timeout=timeout, session=session)
+
 def save_pdfs_from_url_list(urls: Iterable[Optional[str]],
                             outdir: str = "downloaded_pdfs",
                             overwrite: bool = False,
-                            timeout: int = 20) -> List[Dict[str, Any]]:
+                            timeout: int = 20,
+                            max_workers: int = 8,
+                            per_host: int = 4,
+                            session: requests.Session = _SESSION) -> List[Dict[str, Any]]:
     """
-    接受一个 URL 列表（可能包含 None），按顺序处理并尝试下载 PDF。
-    返回每项的字典结果：
+    接受一个 URL 列表（可能包含 None），用线程池并发下载 PDF。
+    max_workers 为总并发数，per_host 为同一域名的最大并发数，所有线程共享 session。
+    生成同一文件名的 URL 只下载一次，结果复制给每个重复项。
+    返回每项的字典结果（与输入顺序一致）：
       { "name": safe_filename or None, "url": original_url, "status": "OK"/"SKIP"/"EXISTS"/"FAIL", "path_or_msg": path_or_message }
     """
     os.makedirs(outdir, exist_ok=True)
-    results: List[Dict[str, Any]] = []
-    session = requests.Session()
+    urls = list(urls)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(urls)
+    names: List[Optional[str]] = [None] * len(urls)
+    owners: Dict[str, int] = {}  # safe_name -> 第一次出现的下标
+    pending = []  # (index, url, save_path)
 
-    for url in urls:
-        res = {"name": None, "url": url, "status": None, "path_or_msg": None}
+    # 在主线程中处理空 URL、推导文件名、去重并跳过已存在的文件
+    for i, url in enumerate(urls):
         if not url:
-            res.update({"status": "SKIP", "path_or_msg": "empty URL or None"})
-            results.append(res)
+            results[i] = {"name": None, "url": url, "status": "SKIP", "path_or_msg": "empty URL or None"}
             continue
 
         safe_name = make_safe_filename_from_url(url)
@@ -164,28 +223,37 @@ def save_pdfs_from_url_list(urls: Iterable[Optional[str]],
             # fallback name
             h = hashlib.sha1(str(url).encode("utf-8")).hexdigest()[:12]
             safe_name = f"file_{h}.pdf"
+        names[i] = safe_name
+        if safe_name in owners:
+            continue
+        owners[safe_name] = i
 
-        res["name"] = safe_name
         save_path = os.path.join(outdir, safe_name)
-
         if os.path.exists(save_path) and not overwrite:
-            res.update({"status": "EXISTS", "path_or_msg": save_path})
-            results.append(res)
+            results[i] = {"name": safe_name, "url": url, "status": "EXISTS", "path_or_msg": save_path}
             continue
+        pending.append((i, url, save_path))
 
-        # 尝试下载（直接使用 requests）
-        ok = download_pdf(url, save_path, timeout=timeout)
-        if ok:
-            res.update({"status": "OK", "path_or_msg": save_path})
-        else:
-            # 清理可能存在的残缺文件
-            if os.path.exists(save_path):
-                try:
-                    os.remove(save_path)
-                except Exception:
-                    pass
-            res.update({"status": "FAIL", "path_or_msg": "could not download PDF or not a PDF"})
-        results.append(res)
+    # 每个域名一个信号量；在主线程中建好，避免工作线程并发修改 dict
+    gates = defaultdict(lambda: threading.Semaphore(per_host))
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = {}
+        for i, url, save_path in pending:
+            gate = gates[_host_key(url)]
+            futures[ex.submit(_download_one, url, save_path, timeout, session, gate)] = (i, save_path)
+        for fut in as_completed(futures):
+            i, save_path = futures[fut]
+            res = {"name": names[i], "url": urls[i]}
+            if fut.result():
+                res.update({"status": "OK", "path_or_msg": save_path})
+            else:
+                res.update({"status": "FAIL", "path_or_msg": "could not download PDF or not a PDF"})
+            results[i] = res
+
+    # 重复项沿用第一次出现时的结果
+    for i, url in enumerate(urls):
+        if results[i] is None:
+            results[i] = dict(results[owners[names[i]]], url=url)
 
     return results
 